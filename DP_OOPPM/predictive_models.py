@@ -2,6 +2,19 @@ import torch.nn as nn
 import torch
 from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
 
+@torch.jit.script
+def last_output_head(lstm_out: torch.Tensor, sequence_lengths: torch.Tensor, weight: torch.Tensor, bias: torch.Tensor) -> torch.Tensor:
+    """
+    Selects the last non-padded LSTM output of every sequence and applies the dense layer and sigmoid activation.
+    Scripted so the gather, linear layer and sigmoid run as one graph, the LSTM itself stays on the cuDNN kernel.
+    The dense layer and sigmoid always run in float32, also under autocast, so the predictions keep their resolution.
+    The dense layer has a single output, so it is written as a multiply and sum, which autocast does not lower.
+    """
+    batch_index = torch.arange(lstm_out.size(0), device=lstm_out.device)
+    last_outputs = lstm_out[batch_index, sequence_lengths - 1, :].float()
+    output = (last_outputs * weight.float()).sum(dim=1, keepdim=True) + bias.float()
+    return torch.sigmoid(output)
+
 class LSTM_Model(nn.Module):
     def __init__(self, 
                  vocab_sizes, 
@@ -100,15 +113,13 @@ class LSTM_Model(nn.Module):
         # Take the last output for classification or regression
         #last_outputs = lstm_out[:, -1, :]  # (batch_size, lstm_size) - last timestep's output for each sequence
         #now we use the last non-padded output!
-        last_outputs = lstm_out[torch.arange(batch_size), sequence_lengths - 1, :]
 
         # Apply batch normalization
         #!if we do also need to permute and re permute afterwards .permute(0, 2, 1)
         #lstm_out = self.bn(lstm_out)
 
-        # Apply final dense layer and sigmoid activation
-        output = self.dense(last_outputs)
-        output = torch.sigmoid(output)
+        # Apply final dense layer and sigmoid activation on the last non-padded outputs
+        output = last_output_head(lstm_out, sequence_lengths, self.dense.weight, self.dense.bias)
 
         return output
 
@@ -1,6 +1,7 @@
 import DP_OOPPM.predictive_models as predictive_models
 import DP_OOPPM.custom_loss_functions as custom_loss_functions
 
+import importlib.util
 import math
 import torch
 from torch.utils.data import DataLoader, TensorDataset
@@ -17,7 +18,12 @@ def train_and_return_LSTM(X_train, seq_len_train, y_train, s_train,
                           patience=10, 
                           get_history=False, 
                           X_val=None, seq_len_val=None, y_val=None, s_val=None,
-                          balance_fair_BCE = 0.1):
+                          balance_fair_BCE = 0.1,
+                          epoch_callback=None,
+                          amp_dtype=None,
+                          num_workers=0,
+                          data_loaders=None,
+                          compile_step=False):
     """
     Trains an LSTM model using the provided training data and returns the trained model.
 
@@ -49,6 +55,15 @@ def train_and_return_LSTM(X_train, seq_len_train, y_train, s_train,
         y_val (Tensor, optional): Validation target labels.
         s_val (Tensor, optional): Sensitive attributes for validation data.
         balance_fair_BCE (float, optional): Balance factor for fairness-aware loss.
+        epoch_callback (callable, optional): Called as epoch_callback(epoch, model) at the end of every epoch,
+            e.g. to report intermediate scores to a hyperparameter search. Exceptions raised by it are propagated.
+        amp_dtype (str, optional): Set to 'bf16' to train and validate with bfloat16 mixed precision on the GPU. Default is full precision.
+        num_workers (int, optional): Number of worker processes used by the data loaders. Default is 0 (load in the main process).
+        data_loaders (tuple, optional): Prebuilt (train_loader, val_loader) from prepare_data_loaders, e.g. shared by several
+            training runs with the same batch size. If given, batch_size and num_workers are not used to build new loaders.
+        compile_step (bool, optional): Whether to compile the forward pass and loss of the training step with
+            torch.compile (mode 'reduce-overhead', CUDA graphs on the GPU). Ignored on the GPU if Triton is not 
+            installed. Default is False.
 
     Returns:
         model (nn.Module): The trained LSTM model.
@@ -104,6 +119,12 @@ def train_and_return_LSTM(X_train, seq_len_train, y_train, s_train,
     #if fair loss we also use bce as balance
     criterion_bce = torch.nn.BCELoss()
 
+    #bfloat16 has the same exponent range as float32, so no gradient scaling is needed
+    if amp_dtype not in (None, 'bf16'):
+        print('No correct amp dtype given, defaulted to full precision')
+        amp_dtype = None
+    use_amp = amp_dtype == 'bf16' and device.type == 'cuda'
+
     # Optimizer and scheduler used by benchmark
     optimizer = torch.optim.AdamW(model.parameters(), lr=learning_rate)
     lr_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(
@@ -111,8 +132,33 @@ def train_and_return_LSTM(X_train, seq_len_train, y_train, s_train,
         threshold_mode='rel', cooldown=0, min_lr=0, eps=1e-08
     )
 
-    # Create DataLoader for training and validation
-    train_loader, val_loader = prepare_data_loaders(X_train, seq_len_train, y_train, s_train, X_val, seq_len_val, y_val, s_val, batch_size)
+    # Create DataLoader for training and validation, unless they are given
+    # Batches are returned in pinned host memory on the GPU, so they can be copied asynchronously
+    if data_loaders is None:
+        data_loaders = prepare_data_loaders(X_train, seq_len_train, y_train, s_train, X_val, seq_len_val, y_val, s_val, batch_size, 
+                                            pin_memory=device.type == 'cuda', num_workers=num_workers)
+    train_loader, val_loader = data_loaders
+
+    def train_step(X_batch, seq_len_batch, y_batch, s_batch):
+        # Forward pass
+        with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=use_amp):
+            outputs = model(X_batch, seq_len_batch)
+
+        # Calculate loss (in full precision, the losses are not autocast safe)
+        return calculate_loss(outputs.float(), y_batch, s_batch, criterion, criterion_bce, loss_function, balance_fair_BCE)
+
+    # Compiling on the GPU needs Triton, which is not part of every environment (e.g. the pinned Windows one)
+    if compile_step and device.type == 'cuda' and importlib.util.find_spec('triton') is None:
+        print('Triton is not installed, training step is not compiled')
+        compile_step = False
+
+    # Shapes are fixed per batch size and max_length, so the step is only recompiled for a smaller last batch
+    # (packing the sequences for the LSTM is data dependent and stays a graph break)
+    if compile_step:
+        # Every call compiles a new train_step closure, so the compiled code of earlier calls in this process is 
+        # dropped, otherwise it counts towards the recompile limit and the step silently falls back to eager mode
+        torch._dynamo.reset()
+        train_step = torch.compile(train_step, mode="reduce-overhead", dynamic=False)
 
     # Early stopping variables
     best_val_loss = np.inf
@@ -140,15 +186,13 @@ def train_and_return_LSTM(X_train, seq_len_train, y_train, s_train,
 
         # Training loop over each batch
         for X_batch, seq_len_batch, y_batch, s_batch in train_loader:
-            X_batch, seq_len_batch, y_batch, s_batch = X_batch.to(device), seq_len_batch.to(device), y_batch.to(device), s_batch.to(device)
+            X_batch, seq_len_batch, y_batch, s_batch = X_batch.to(device, non_blocking=True), seq_len_batch.to(device, non_blocking=True), y_batch.to(device, non_blocking=True), s_batch.to(device, non_blocking=True)
 
-            # Forward pass
-            outputs = model(X_batch, seq_len_batch)
             #restore greadients to zero
             optimizer.zero_grad()
-            
-            # Calculate loss
-            loss = calculate_loss(outputs, y_batch, s_batch, criterion, criterion_bce, loss_function, balance_fair_BCE)
+
+            # Forward pass and loss
+            loss = train_step(X_batch, seq_len_batch, y_batch, s_batch)
 
             # Backward pass and optimize
             loss.backward()
@@ -165,14 +209,16 @@ def train_and_return_LSTM(X_train, seq_len_train, y_train, s_train,
         if X_val is not None and seq_len_val is not None and y_val is not None and s_val is not None:
             model.eval()
             val_epoch_loss = 0.0
-            with torch.no_grad():
+            with torch.inference_mode():
                 for X_val_batch, seq_len_val_batch, y_val_batch, s_val_batch in val_loader:
                     # Move tensors to device
-                    X_val_batch, seq_len_val_batch, y_val_batch, s_val_batch = X_val_batch.to(device), seq_len_val_batch.to(device), y_val_batch.to(device), s_val_batch.to(device)
-                    val_outputs = model(X_val_batch, seq_len_val_batch)
+                    X_val_batch, seq_len_val_batch, y_val_batch, s_val_batch = X_val_batch.to(device, non_blocking=True), seq_len_val_batch.to(device, non_blocking=True), y_val_batch.to(device, non_blocking=True), s_val_batch.to(device, non_blocking=True)
+                    # Same mixed precision as the training step when amp_dtype is set, the loss itself is computed in full precision
+                    with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=use_amp):
+                        val_outputs = model(X_val_batch, seq_len_val_batch)
                     
                     # Calculate validation loss
-                    val_loss = calculate_loss(val_outputs, y_val_batch, s_val_batch, criterion, criterion_bce, loss_function, balance_fair_BCE)
+                    val_loss = calculate_loss(val_outputs.float(), y_val_batch, s_val_batch, criterion, criterion_bce, loss_function, balance_fair_BCE)
                     
                     val_epoch_loss += val_loss.item()
             
@@ -194,6 +240,9 @@ def train_and_return_LSTM(X_train, seq_len_train, y_train, s_train,
 
         lr_scheduler.step(avg_train_loss)
 
+        if epoch_callback is not None:
+            epoch_callback(epoch, model)
+
         # Print progress
         if (epoch + 1) % 10 == 0:
             print(f"Epoch [{epoch+1}/{max_epochs}], Loss: {avg_train_loss:.4f}")
@@ -240,7 +289,7 @@ def calculate_loss(outputs, y_batch, s_batch, criterion, criterion_bce, loss_fun
     return (1.0 - balance_fair_BCE) * bce_loss + balance_fair_BCE * fair_loss
 
 
-def prepare_data_loaders(X_train, seq_len_train, y_train, s_train, X_val, seq_len_val, y_val, s_val, batch_size):
+def prepare_data_loaders(X_train, seq_len_train, y_train, s_train, X_val, seq_len_val, y_val, s_val, batch_size, pin_memory=False, num_workers=0):
     """
     Prepares data loaders for training and validation datasets.
 
@@ -254,17 +303,25 @@ def prepare_data_loaders(X_train, seq_len_train, y_train, s_train, X_val, seq_le
         y_val (Tensor): Validation target data.
         s_val (Tensor): Additional validation data.
         batch_size (int): Number of samples per batch.
+        pin_memory (bool, optional): Whether to return batches in pinned memory, for asynchronous copies to the GPU.
+        num_workers (int, optional): Number of worker processes for the training data loader. If larger than 0, 
+            the workers are kept alive between epochs and prefetch batches. The validation data is not shuffled and 
+            is always loaded in the main process.
 
     Returns:
         tuple: A tuple containing the training data loader and the validation data loader.
             The validation data loader is None if validation data is not provided.
     """
+    loader_kwargs = {'pin_memory': pin_memory, 'num_workers': num_workers}
+    if num_workers > 0:
+        loader_kwargs.update(persistent_workers=True, prefetch_factor=4)
+
     train_dataset = TensorDataset(X_train, seq_len_train, y_train, s_train)
-    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
+    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, **loader_kwargs)
     
     if X_val is not None and seq_len_val is not None and y_val is not None and s_val is not None:
         val_dataset = TensorDataset(X_val, seq_len_val, y_val, s_val)
-        val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False)
+        val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False, pin_memory=pin_memory)
     else:
         val_loader = None
     return train_loader, val_loader
\ No newline at end of file
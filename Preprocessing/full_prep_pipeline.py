@@ -2,6 +2,10 @@ import Preprocessing.import_data as imp
 import Preprocessing.log_preparation_specific as prepare
 import Preprocessing.list_to_tensor as convert
 
+import os
+import tempfile
+import torch
+
 def full_prep(filename, logname, max_prefix_len, drop_sensitive, sensitive_column):
     """
     Executes the full preprocessing pipeline for an event log file.
@@ -41,4 +45,46 @@ def full_prep(filename, logname, max_prefix_len, drop_sensitive, sensitive_colum
     y_te = convert.list_to_tensor(te_y).view(-1, 1)
     s_te = convert.list_to_tensor(te_s)
 
-    return X_train, seq_len_train, y_train, s_train, X_val, seq_len_val, y_val, s_val, X_te, seq_len_te, y_te, s_te, vocsizes, num_numerical_features, new_max_prefix_len
\ No newline at end of file
+    return X_train, seq_len_train, y_train, s_train, X_val, seq_len_val, y_val, s_val, X_te, seq_len_te, y_te, s_te, vocsizes, num_numerical_features, new_max_prefix_len
+
+def full_prep_cached(filename, logname, max_prefix_len, drop_sensitive, sensitive_column, cache_dir='cache'):
+    """
+    Executes the full preprocessing pipeline, reusing the result of a previous run if available.
+
+    The output of full_prep is saved to a .pt file in cache_dir, keyed by the dataset file,
+    log type, maximum prefix length and sensitive column settings. On subsequent calls the
+    tensors are memory-mapped from this file, instead of importing and preparing the XES log again.
+
+    Parameters:
+        filename (str): Path to the XES file to be imported.
+        logname (str): Type of log for determining preprocessing steps.
+        max_prefix_len (int): Maximum length of prefixes to generate.
+        drop_sensitive (bool): Whether to drop the sensitive column.
+        sensitive_column (str): Column name for sensitive attributes.
+        cache_dir (str, optional): Folder in which the preprocessed data is stored. Default is 'cache'.
+
+    Returns:
+        tuple: The same output as full_prep.
+    """
+    dataset = os.path.basename(filename).split('.')[0]
+    cache_path = f"{cache_dir}/{dataset}_{logname}_{max_prefix_len}_{sensitive_column}_{drop_sensitive}.pt"
+    cache_path = cache_path.replace(" ", "").replace(":", "")
+
+    if os.path.exists(cache_path):
+        return tuple(torch.load(cache_path, map_location="cpu", mmap=True).values())
+
+    prepared = full_prep(filename=filename, logname=logname, max_prefix_len=max_prefix_len, 
+                         drop_sensitive=drop_sensitive, sensitive_column=sensitive_column)
+    names = ['X_train', 'seq_len_train', 'y_train', 's_train', 'X_val', 'seq_len_val', 'y_val', 's_val', 
+             'X_te', 'seq_len_te', 'y_te', 's_te', 'vocsizes', 'num_numerical_features', 'new_max_prefix_len']
+    os.makedirs(cache_dir, exist_ok=True)
+    # Written to a temporary file first, so an interrupted run never leaves a truncated cache behind
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    os.close(fd)
+    try:
+        torch.save(dict(zip(names, prepared)), tmp_path)
+        os.replace(tmp_path, cache_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return prepared
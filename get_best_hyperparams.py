@@ -1,4 +1,5 @@
 import pandas as pd
+import os
 
 def get_best_hyperparameter_combination(logname, addendum):
     """
@@ -45,6 +46,9 @@ def get_best_hyperparameter_combination(logname, addendum):
 def find_worst_hyperparameters(logname, addendum):
     """
     Load the hyperparameter tuning log and analyze which hyperparameter choices lead to the worst average AUC scores.
+    For a search run in two stages, the stage 1 log is used, since the main log only holds the best stage 1 combinations.
+    The stage 1 log only holds the trials that completed their training budget, as trials stopped early by the scheduler 
+    are not written to it, so the averages do not mix partially trained scores with fully trained ones.
     
     Parameters:
         logname (str): The base name of the log file (without the '_hyperparameter_tuning_results.csv' suffix).
@@ -53,7 +57,9 @@ def find_worst_hyperparameters(logname, addendum):
         dict: A dictionary with each hyperparameter and its value that led to the worst average AUC score.
     """
     # Define the log file path
-    log_path = f"Results/Hyperparameters/BCE/{logname}_{addendum}_hyperparameter_tuning_results.csv"
+    log_path = f"Results/Hyperparameters/BCE/{logname}_{addendum}_hyperparameter_tuning_results_stage1.csv"
+    if not os.path.exists(log_path):
+        log_path = f"Results/Hyperparameters/BCE/{logname}_{addendum}_hyperparameter_tuning_results.csv"
     
     try:
         # Load the log data
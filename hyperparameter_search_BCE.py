@@ -2,137 +2,348 @@ import Preprocessing.full_prep_pipeline as prepare
 import DP_OOPPM.train_model as train_model
 
 import pandas as pd
-from sklearn.metrics import roc_auc_score
-from itertools import product
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import csv
+import gc
+import glob
 import logging
+import optuna
+import ray
+from ray import train, tune
+from ray.tune.schedulers import ASHAScheduler
+from ray.tune.search.basic_variant import BasicVariantGenerator
+from ray.tune.search.optuna import OptunaSearch
 import torch
+from torchmetrics.functional.classification import binary_auroc
 
 import os
 
+# Reduces fragmentation between trials with different batch and hidden sizes
+# (inherited by the Ray worker processes, and read when they initialize CUDA)
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
+
+# Set COMPILE_TRAIN_STEP=1 to compile the training step of the GPU trials with torch.compile (needs Triton)
+compile_train_step = os.environ.get("COMPILE_TRAIN_STEP", "0") == "1"
 
 # Main hyperparameter tuning function
-def run_hyper(dataset_name, logname, max_prefix_len, addendum):
+def run_hyper(dataset_name, logname, max_prefix_len, addendum, n_trials=40, top_k=10, use_gpu=False):
     """
     Runs hyperparameter tuning for an LSTM model on a specified dataset.
 
-    This function sets up logging, prepares the data, generates combinations of 
-    hyperparameters, and iterates over them to train and evaluate models. It logs 
-    the AUC scores for each combination and saves the results to a CSV file. 
-    Previously completed combinations are skipped to avoid redundant computations.
+    This function sets up logging, prepares the data and runs the search in two stages 
+    of Ray Tune experiments. In the first stage, all trials get a short training budget: 
+    Optuna's TPE sampler proposes promising combinations and the ASHA scheduler stops 
+    trials early based on the validation AUC reported after every epoch. In the second 
+    stage, only the top_k combinations of the first stage are trained with the full 
+    budget. Trials run concurrently on the available GPUs/CPUs. The experiments are 
+    stored on disk, so an interrupted search resumes where it stopped. The result of 
+    every finished trial is appended to a CSV file per stage.
 
     Parameters:
         dataset_name (str): Path to the dataset file.
         logname (str): Type of log for determining preprocessing steps.
         max_prefix_len (int): Maximum length of prefixes to generate.
         addendum (str): Additional identifier for the results file.
+        n_trials (int, optional): Number of trials in the first stage. Default is 40.
+        top_k (int, optional): Number of combinations retrained in the second stage. Default is 10.
+        use_gpu (bool, optional): Whether every trial reserves a GPU. Default is False.
 
     Returns:
-        pd.DataFrame: A DataFrame containing the results of the hyperparameter tuning.
+        pd.DataFrame: A DataFrame containing the results of the second stage of the hyperparameter tuning.
     """
     # Log setup
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
     # Data Preparation
-    X_train, seq_len_train, y_train, s_train, X_val, seq_len_val, y_val, s_val, _, _, _, _, vocsizes, num_numerical_features, new_max_prefix_len = prepare.full_prep(filename=dataset_name, logname=logname, 
+    X_train, seq_len_train, y_train, s_train, X_val, seq_len_val, y_val, s_val, _, _, _, _, vocsizes, num_numerical_features, new_max_prefix_len = prepare.full_prep_cached(filename=dataset_name, logname=logname, 
                                                                                                                                                                                        max_prefix_len=max_prefix_len, drop_sensitive=False, 
                                                                                                                                                                                        sensitive_column='case:gender')
+    # Sort the validation set by descending length once, so the validation batches have stable shapes
+    val_order = torch.argsort(seq_len_val, descending=True)
+    X_val, seq_len_val, y_val, s_val = X_val[val_order], seq_len_val[val_order], y_val[val_order], s_val[val_order]
+
+    # Loaded once in the driver and shared by all trials through the Ray object store
+    data = {
+        'X_train': X_train, 'seq_len_train': seq_len_train, 'y_train': y_train, 's_train': s_train, 
+        'X_val': X_val, 'seq_len_val': seq_len_val, 'y_val': y_val, 's_val': s_val, 
+        'vocab_sizes': vocsizes, 'num_numerical_features': num_numerical_features, 'max_length': new_max_prefix_len
+    }
     
     # Hyperparameter grids
-    num_layers_lst = [1, 2]
-    bidirectional_lst = [False, True]
-    LSTM_size_lst = [16, 32, 64]
-    batch_size_lst = [128, 256, 512] #we need a large size anyway later
-    learning_rate_lst = [0.0001, 0.001]
-    dropout_lst = [0.2, 0.4]
+    search_space = {
+        'num_layers': tune.choice([1, 2]),
+        'bidirectional': tune.choice([False, True]),
+        'lstm_size': tune.choice([16, 32, 64]),
+        'batch_size': tune.choice([128, 256, 512]), #we need a large size anyway later
+        'learning_rate': tune.choice([0.0001, 0.001]),
+        'dropout': tune.choice([0.2, 0.4]), #applied to the LSTM inputs, so it also matters for a single layer
+    }
+
+    # Stage 1: short budget for every trial
+    # After 10 and after 20 epochs (the only rungs below max_t), trials below the median AUC of their rung are stopped
+    stage1_path = f"Results/Hyperparameters/BCE/{logname}_{addendum}_hyperparameter_tuning_results_stage1.csv"
+    # train_fn reports once per epoch and once more for the best state, max_t is above the epochs so that last report is not cut off
+    run_stage(data, f"{logname}_{addendum}_stage1", {**search_space, 'max_epochs': 30, 'patience': 5}, n_trials, 
+              OptunaSearch(sampler=optuna.samplers.TPESampler()), 
+              ASHAScheduler(max_t=31, grace_period=10, reduction_factor=2), 
+              stage1_path, use_gpu)
+
+    # Stage 2: full budget, only for the best combinations of stage 1
+    # Its CSV has the format used to select the best hyperparameters
+    stage1_df = pd.read_csv(stage1_path).sort_values('auc_score', ascending=False)
+    top_configs = stage1_df.drop_duplicates(CSVResultWriter.hyperparameter_columns)[CSVResultWriter.hyperparameter_columns].head(top_k).to_dict('records')
+    results_path = f"Results/Hyperparameters/BCE/{logname}_{addendum}_hyperparameter_tuning_results.csv"
+    run_stage(data, f"{logname}_{addendum}_stage2", {**search_space, 'max_epochs': 300, 'patience': 20}, len(top_configs), 
+              BasicVariantGenerator(points_to_evaluate=top_configs), 
+              None, 
+              results_path, use_gpu)
+    
+    # Return the final results DataFrame (optional)
+    return pd.read_csv(results_path)
 
+def run_stage(data, name, config, num_samples, search_alg, scheduler, results_path, use_gpu=False):
+    """
+    Runs one stage of the hyperparameter search as a Ray Tune experiment.
 
-    # Generate all combinations of hyperparameters
-    hyperparameter_combinations = list(product(num_layers_lst, bidirectional_lst, LSTM_size_lst, batch_size_lst, 
-                                               learning_rate_lst, dropout_lst))
-    
-    # Check for existing results file
-    results_path = f"Results/Hyperparameters/BCE/{logname}_{addendum}_hyperparameter_tuning_results.csv"
-    if os.path.exists(results_path):
-        # Load existing results
-        existing_results_df = pd.read_csv(results_path)
-        # Extract completed hyperparameter combinations to skip
-        completed_combinations = set(
-            tuple(row) for row in existing_results_df[['num_layers', 'bidirectional', 'lstm_size', 
-                                                       'batch_size', 'learning_rate', 'dropout']].itertuples(index=False, name=None)
-        )
-    else:
-        # Initialize an empty DataFrame if results file doesn't exist
-        existing_results_df = pd.DataFrame(columns=['num_layers', 'bidirectional', 'lstm_size', 'batch_size', 
-                                                    'learning_rate', 'dropout', 'auc_score'])
-        completed_combinations = set()
+    The experiment is resumed if it already exists, so finished trials are not repeated. 
+    The result of every finished trial is appended to the results CSV file, which is rebuilt 
+    from the stored experiment state when resuming.
+
+    Parameters:
+        data (dict): The preprocessed training and validation data.
+        name (str): Name of the experiment.
+        config (dict): The search space, including the training budget (max_epochs and patience).
+        num_samples (int): Number of trials.
+        search_alg (Searcher): Ray Tune search algorithm proposing the combinations.
+        scheduler (TrialScheduler): Ray Tune scheduler, None to train all trials with the full budget.
+        results_path (str): Path to the results CSV file.
+        use_gpu (bool, optional): Whether every trial reserves a GPU. Default is False.
+    """
+    storage_path = os.path.abspath("Results/Hyperparameters/BCE/ray")
+    # A resumed experiment keeps the results of its finished trials, a new one starts a new CSV file
+    experiment_path = os.path.join(storage_path, name)
+    finished_trials = []
+    # tune.run stores its state as experiment_state-*.json (it writes no tuner.pkl, so Tuner.can_restore does not apply)
+    if glob.glob(os.path.join(experiment_path, "experiment_state-*.json")):
+        finished_trials = [trial for trial in tune.ExperimentAnalysis(experiment_path).trials if trial.status == "TERMINATED"]
+    tune.run(
+        tune.with_parameters(train_fn, data=data), 
+        name=name, 
+        config=config, 
+        metric="auc", 
+        mode="max", 
+        search_alg=search_alg, 
+        scheduler=scheduler, 
+        resources_per_trial={"cpu": 4, "gpu": 1 if use_gpu else 0}, 
+        num_samples=num_samples, 
+        storage_path=storage_path, 
+        resume="AUTO", 
+        reuse_actors=True, 
+        callbacks=[CSVResultWriter(results_path, finished_trials)]
+    )
+
+def train_fn(config, data):
+    """
+    Trains and evaluates a single hyperparameter combination as a Ray Tune trial.
+
+    The validation AUC is reported after every epoch, so the scheduler can stop 
+    hopeless trials early, and once more for the final (best) model.
+
+    Parameters:
+        config (dict): The hyperparameter combination sampled for this trial.
+        data (dict): The preprocessed training and validation data.
+    """
+    # Set in the trial process itself, cuDNN then caches the fastest LSTM kernel per input shape
+    torch.backends.cudnn.benchmark = True
+    torch.backends.cuda.matmul.allow_tf32 = True
+
+    # A reused actor may still hold the memory of a previous trial that was stopped early
+    free_gpu_memory()
+
+    logging.info(f"Training with hyperparameters: {config}")
+
+    # Moved to the device once, as the model is evaluated after every epoch
+    # (pinned here, since the tensors lose their pinned memory when shared through the object store)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    X_val, seq_len_val, y_val = data['X_val'], data['seq_len_val'], data['y_val']
+    if device.type == "cuda":
+        X_val, seq_len_val, y_val = X_val.pin_memory(), seq_len_val.pin_memory(), y_val.pin_memory()
+    X_val, seq_len_val, y_val = X_val.to(device, non_blocking=True), seq_len_val.to(device, non_blocking=True), y_val.to(device, non_blocking=True)
+    # Flattened integer targets, as used for the AUC, so they are not converted again at every evaluation
+    y_val = y_val.view(-1).int()
+
+    def report_auc(epoch, model):
+        train.report({"auc": evaluate_model(model, X_val, y_val, seq_len_val), "final": False})
+
+    data_loaders = get_data_loaders(data, config['batch_size'])
+
+    # Initialize and train the model
+    #we decreased the patience a bit, since e are just interested in best setup
+    model = initialize_model(
+        X_train=data['X_train'], 
+        seq_len_train=data['seq_len_train'], 
+        y_train=data['y_train'], 
+        s_train=data['s_train'], 
+        vocab_sizes=data['vocab_sizes'], 
+        num_numerical_features=data['num_numerical_features'], 
+        num_layers=config['num_layers'], 
+        bidirectional=config['bidirectional'], 
+        lstm_size=config['lstm_size'], 
+        batch_size=config['batch_size'], 
+        learning_rate=config['learning_rate'], 
+        dropout=config['dropout'], 
+        max_length=data['max_length'],
+        max_epochs=config['max_epochs'], 
+        patience=config['patience'], 
+        X_val=data['X_val'], 
+        seq_len_val=data['seq_len_val'], 
+        y_val=data['y_val'], 
+        s_val=data['s_val'],
+        epoch_callback=report_auc,
+        data_loaders=data_loaders,
+        compile_step=compile_train_step and device.type == "cuda"
+    )
     
-    # List to store new results
-    new_results = []
-
-    # Filter out completed combinations
-    combinations_to_run = [comb for comb in hyperparameter_combinations if comb not in completed_combinations]
-
-    for combination in combinations_to_run:
-        num_layers, bidirectional, lstm_size, batch_size, learning_rate, dropout = combination
-        
-        logging.info(f"Training with hyperparameters: {combination}")
-
-        # Initialize and train the model
-        #we decreased the patience a bit, since e are just interested in best setup
-        model = initialize_model(
-            X_train=X_train, 
-            seq_len_train=seq_len_train, 
-            y_train=y_train, 
-            s_train=s_train, 
-            vocab_sizes=vocsizes, 
-            num_numerical_features=num_numerical_features, 
-            num_layers=num_layers, 
-            bidirectional=bidirectional, 
-            lstm_size=lstm_size, 
-            batch_size=batch_size, 
-            learning_rate=learning_rate, 
-            dropout=dropout, 
-            max_length=new_max_prefix_len,
-            max_epochs=300, 
-            patience=20, 
-            X_val=X_val, 
-            seq_len_val=seq_len_val, 
-            y_val=y_val, 
-            s_val=s_val
-        )
-        
-        # Evaluate the model
-        auc = evaluate_model(model, X_val, y_val, seq_len_val)
-        
-        # Log results
-        logging.info(f"AUC for {combination}: {auc}")
-        
-        # Save hyperparameters and AUC to new_results list
-        new_results.append({
-            'num_layers': num_layers,
-            'bidirectional': bidirectional,
-            'lstm_size': lstm_size,
-            'batch_size': batch_size,
-            'learning_rate': learning_rate,
-            'dropout': dropout,
-            'auc_score': auc
-        })
-
-        # Save intermediate results to CSV after each iteration
-        temp_results_df = pd.DataFrame(new_results)
-        results_df = pd.concat([existing_results_df, temp_results_df], ignore_index=True)
-        results_df.to_csv(results_path, index=False)
-
-    # Final save of all results to CSV
-    results_df = pd.concat([existing_results_df, pd.DataFrame(new_results)], ignore_index=True)
-    results_df.to_csv(results_path, index=False)
+    # Evaluate the model
+    # Scored with the full precision model, the AUCs of the best combinations are too close to allow quantization noise
+    auc = evaluate_model(model, X_val, y_val, seq_len_val)
     
-    # Return the final results DataFrame (optional)
-    return results_df
+    # Free the model before the next trial in this actor
+    del model
+    free_gpu_memory()
+
+    # Log results
+    logging.info(f"AUC for {config}: {auc}")
+    # Marked as final, so the results CSV can tell it apart from the AUC of a trial stopped by the scheduler
+    train.report({"auc": auc, "final": True})
+
+def free_gpu_memory():
+    # Releases the cached GPU memory of models, optimizer states and activations that are no longer referenced
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats()
+
+# Data loaders of the last used batch size, kept alive between the trials that run in the same (reused) Ray actor
+data_loaders_cache = {}
+
+def get_data_loaders(data, batch_size, num_workers=4):
+    """
+    Returns the training and validation data loaders for a batch size, reusing them while the batch size stays the same.
+
+    Since the training loader uses persistent workers, the worker processes are not restarted for every trial. 
+    Only the loaders of one batch size are kept, so an actor never holds more than num_workers worker processes. 
+    The cache is only valid for a single dataset, which holds within one Ray Tune experiment, as actors are not 
+    reused across experiments.
+
+    Parameters:
+        data (dict): The preprocessed training and validation data.
+        batch_size (int): Number of samples per batch.
+        num_workers (int, optional): Number of worker processes of the training data loader. Default is 4.
+
+    Returns:
+        tuple: The training and validation data loaders.
+    """
+    if batch_size not in data_loaders_cache:
+        # Dropping the old loaders shuts down their workers
+        data_loaders_cache.clear()
+        data_loaders_cache[batch_size] = train_model.prepare_data_loaders(
+            data['X_train'], data['seq_len_train'], data['y_train'], data['s_train'], 
+            data['X_val'], data['seq_len_val'], data['y_val'], data['s_val'], batch_size, 
+            pin_memory=torch.cuda.is_available(), num_workers=num_workers)
+    return data_loaders_cache[batch_size]
+
+class CSVResultWriter(tune.Callback):
+    """
+    Ray Tune callback that appends the hyperparameters and final AUC of every finished 
+    trial as a single row to the results CSV file, so each trial costs one row write 
+    instead of a full rewrite. Trials stopped early by the scheduler only reported the 
+    AUC of a partially trained model and are left out, so all rows are comparable. The file is rewritten when the experiment starts, 
+    so the rows of an earlier search are never mixed with the new ones. When resuming, 
+    it starts from the trials that had already finished, as stored in the experiment 
+    state, so rows that were not yet written when the search was interrupted are not lost.
+    The rows are buffered and written in batches by a background thread, so the next 
+    trial does not wait for the file I/O. Remaining rows are written when a trial fails 
+    and at the end of the experiment, and a failed write is raised instead of ignored.
+
+    Parameters:
+        results_path (str): Path to the results CSV file.
+        finished_trials (list, optional): Trials of a resumed experiment that already finished. Default is None.
+        flush_every (int, optional): Number of buffered rows that triggers a write. Default is 5.
+    """
+    hyperparameter_columns = ['num_layers', 'bidirectional', 'lstm_size', 'batch_size', 'learning_rate', 'dropout']
+
+    def __init__(self, results_path, finished_trials=None, flush_every=5):
+        self.results_path = results_path
+        self.finished_trials = finished_trials or []
+        self.flush_every = flush_every
+        self.file = None
+        self.writer = None
+        self.io_pool = None
+        self.futures = []
+        self.pending_rows = []
+
+    def setup(self, **info):
+        self.file = open(self.results_path, "w", newline="")
+        self.writer = csv.DictWriter(self.file, fieldnames=self.hyperparameter_columns + ['auc_score'])
+        self.writer.writeheader()
+        self.write_rows([self.result_row(trial) for trial in self.finished_trials if self.is_final(trial)])
+        # A single worker keeps the writes in order
+        self.io_pool = ThreadPoolExecutor(max_workers=1)
+
+    def is_final(self, trial):
+        return trial.last_result.get('final', False)
+
+    def result_row(self, trial):
+        row = {column: trial.config[column] for column in self.hyperparameter_columns}
+        row['auc_score'] = trial.last_result['auc']
+        return row
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+        self.file.flush()
+
+    def check_writes(self):
+        # result() raises the exception of a failed write
+        for future in [future for future in self.futures if future.done()]:
+            future.result()
+            self.futures.remove(future)
+
+    def flush(self):
+        self.check_writes()
+        if self.pending_rows:
+            self.futures.append(self.io_pool.submit(self.write_rows, self.pending_rows.copy()))
+            self.pending_rows.clear()
+
+    def close(self):
+        if self.file is None or self.file.closed:
+            return
+        self.flush()
+        self.io_pool.shutdown(wait=True)
+        self.file.close()
+        self.check_writes()
+
+    def on_trial_complete(self, iteration, trials, trial, **info):
+        # Also called for trials stopped by the scheduler
+        if not self.is_final(trial):
+            return
+        self.pending_rows.append(self.result_row(trial))
+        if len(self.pending_rows) >= self.flush_every:
+            self.flush()
+
+    def on_trial_error(self, iteration, trials, trial, **info):
+        # The search may be about to stop, so the finished trials are written now
+        self.flush()
+
+    def on_experiment_end(self, trials, **info):
+        # Everything is written before the results are read back
+        self.close()
 
 def initialize_model(X_train, seq_len_train, y_train, s_train, vocab_sizes, num_numerical_features, 
                      num_layers, bidirectional, lstm_size, batch_size, learning_rate, dropout, 
-                     max_length, max_epochs, patience, X_val, seq_len_val, y_val, s_val):
+                     max_length, max_epochs, patience, X_val, seq_len_val, y_val, s_val, epoch_callback=None, amp_dtype='bf16', num_workers=4, data_loaders=None, 
+                     compile_step=False):
     #Initializes and trains an LSTM model using the specified training and validation data.
     model = train_model.train_and_return_LSTM(
         X_train=X_train, 
@@ -155,60 +366,87 @@ def initialize_model(X_train, seq_len_train, y_train, s_train, vocab_sizes, num_
         X_val=X_val, 
         seq_len_val=seq_len_val, 
         y_val=y_val, 
-        s_val=s_val
+        s_val=s_val,
+        epoch_callback=epoch_callback,
+        amp_dtype=amp_dtype,
+        num_workers=num_workers,
+        data_loaders=data_loaders,
+        compile_step=compile_step
     )
     return model
 
-def evaluate_model(model, X_val, y_val, seq_len_val):
+def evaluate_model(model, X_val, y_val, seq_len_val, batch_size=1024, quantize=False, max_auc_difference=0.01, guard_size=1024):
     """
     Evaluates the performance of a given model on validation data using the AUC metric.
 
     This function moves the model and validation data to the appropriate device (GPU if available),
     performs a forward pass to obtain predictions, and computes the AUC score based on the ground
-    truth and predicted values.
+    truth and predicted values. The AUC is computed on the same device, so the predictions are not
+    copied back to the CPU. Tensors that are already on the device are not copied again.
+    The forward pass is done in batches, in half precision on the GPU, without autograd tracking.
+    On the CPU, a copy of the model with a dynamically int8 quantized LSTM can be used instead, unless 
+    its AUC on an evenly spaced subset of the validation data deviates too much from the original model.
+    Quantizing and checking the subset costs more than it saves for a single pass, so it is only worth it 
+    for a large validation set, and the subset is skipped when it would be the whole validation set.
 
     Parameters:
         model (torch.nn.Module): The model to be evaluated.
         X_val (torch.Tensor): Validation input data.
-        y_val (torch.Tensor): Ground truth labels for the validation data.
+        y_val (torch.Tensor): Ground truth labels for the validation data. Not converted again if they 
+            are already a flattened integer tensor on the device.
         seq_len_val (torch.Tensor): Sequence lengths for the validation data.
+        batch_size (int, optional): Number of samples per forward pass. Default is 1024.
+        quantize (bool, optional): Whether to use the quantized model on the CPU. Default is False.
+        max_auc_difference (float, optional): Largest AUC difference on the subset for which the quantized 
+            model is used. Default is 0.01.
+        guard_size (int, optional): Approximate number of samples in the subset. Default is 1024.
 
     Returns:
         float: The AUC score of the model on the validation data.
     """
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     model.to(device)
-    X_val, seq_len_val = X_val.to(device), seq_len_val.to(device)
-
-    val_output = model(X_val, seq_len_val)
-    val_np = val_output.detach().cpu().numpy()
-
-    # Get the ground truth and predictions
-    y_gt = y_val.numpy().ravel()
-    y_pred = val_np.ravel()
+    X_val, seq_len_val, y_val = X_val.to(device), seq_len_val.to(device), y_val.to(device).view(-1).int()
+
+    def compute_auc(model, X_val, seq_len_val, y_val):
+        with torch.inference_mode(), torch.autocast(device_type=device.type, dtype=torch.float16, enabled=device.type == "cuda"):
+            val_outputs = [model(X_batch, seq_len_batch) for X_batch, seq_len_batch in zip(X_val.split(batch_size), seq_len_val.split(batch_size))]
+            val_output = torch.cat(val_outputs)
+        return binary_auroc(val_output.view(-1).float(), y_val).item()
+
+    # The copy keeps the model that is being trained intact
+    if device.type == "cpu" and quantize:
+        step = len(X_val) // guard_size
+        if step < 2:
+            # The subset would be the whole validation set, its full precision AUC is the result
+            return compute_auc(model, X_val, seq_len_val, y_val)
+        quantized_model = torch.ao.quantization.quantize_dynamic(copy.deepcopy(model), {torch.nn.LSTM}, dtype=torch.qint8)
+        X_guard, seq_len_guard, y_guard = X_val[::step], seq_len_val[::step], y_val[::step]
+        if abs(compute_auc(model, X_guard, seq_len_guard, y_guard) - compute_auc(quantized_model, X_guard, seq_len_guard, y_guard)) <= max_auc_difference:
+            model = quantized_model
 
     # Compute AUC score
-    auc = roc_auc_score(y_gt, y_pred)
+    auc = compute_auc(model, X_val, seq_len_val, y_val)
     return auc
 
-
-run_hyper('Datasets/lending_log_high.xes.gz', 'lending', 6, 'high')
-
-run_hyper('Datasets/lending_log_medium.xes.gz', 'lending', 6, 'medium')
-
-run_hyper('Datasets/lending_log_low.xes.gz', 'lending', 6, 'low')
-
-
-run_hyper('Datasets/hiring_log_high.xes.gz', 'hiring', 6, 'high')
-
-run_hyper('Datasets/hiring_log_medium.xes.gz', 'hiring', 6, 'medium')
-
-run_hyper('Datasets/hiring_log_low.xes.gz', 'hiring', 6, 'low')
-
-
-run_hyper('Datasets/renting_log_high.xes.gz', 'renting', 6, 'high')
-
-run_hyper('Datasets/renting_log_medium.xes.gz', 'renting', 6, 'medium')
-
-run_hyper('Datasets/renting_log_low.xes.gz', 'renting', 6, 'low')
-
+datasets = [
+    ('Datasets/lending_log_high.xes.gz', 'lending', 6, 'high'),
+    ('Datasets/lending_log_medium.xes.gz', 'lending', 6, 'medium'),
+    ('Datasets/lending_log_low.xes.gz', 'lending', 6, 'low'),
+
+    ('Datasets/hiring_log_high.xes.gz', 'hiring', 6, 'high'),
+    ('Datasets/hiring_log_medium.xes.gz', 'hiring', 6, 'medium'),
+    ('Datasets/hiring_log_low.xes.gz', 'hiring', 6, 'low'),
+
+    ('Datasets/renting_log_high.xes.gz', 'renting', 6, 'high'),
+    ('Datasets/renting_log_medium.xes.gz', 'renting', 6, 'medium'),
+    ('Datasets/renting_log_low.xes.gz', 'renting', 6, 'low'),
+]
+
+if __name__ == "__main__":
+    # The datasets are searched one after another, the trials of each search already run concurrently on the cluster
+    # (Ray Tune does not support several experiments running on the same cluster at once)
+    ray.init()
+    use_gpu = ray.cluster_resources().get("GPU", 0) > 0
+    for dataset in datasets:
+        run_hyper(*dataset, use_gpu=use_gpu)